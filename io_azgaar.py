@@ -2,15 +2,35 @@ bl_info = {
     "name": "Import Azgaar Fantasy Map",
     "author": "mimmackk",
     "version": (1, 0),
-    "blender": (2, 80, 0),
+    "blender": (3, 2, 0),
     "category": "Import-Export",
 }
 
 import bpy
+import os
 import json
 import bmesh
+import numpy as np
 from bpy_extras.io_utils import ImportHelper
+from array import array
 from contextlib import contextmanager
+from operator import itemgetter
+
+# orjson parses large exports much faster, but is not bundled with Blender
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ijson streams very large exports in less memory, also not bundled; only its
+# C backend is fast enough to use, and use_float needs version 3.1 or later
+try:
+    import ijson
+    ijson_version = tuple(int(v) for v in ijson.__version__.split(".")[:2])
+    if ijson.backend != "yajl2_c" or ijson_version < (3, 1):
+        ijson = None
+except (ImportError, AttributeError, ValueError):
+    ijson = None
 
 ################################################################################
 # BLENDER OBJECT HELPERS
@@ -34,7 +54,7 @@ def bmesh_from_obj(obj):
 
 # Create a new empty mesh object -----------------------------------------------
 
-def create_mesh(self, context, collection, name):
+def create_mesh(self, context, collection, name, set_active = True):
 
     # Create a new mesh object within collection
     mesh = bpy.data.meshes.new(name)
@@ -42,12 +62,34 @@ def create_mesh(self, context, collection, name):
     collection.objects.link(obj)
 
     # Set as active & selected for any subsequent operations
-    context.view_layer.objects.active = obj
-    context.object.select_set(True)
+    if set_active:
+        select_objects(self, context, [obj])
 
     return obj
 
 
+# Select a batch of objects, making the last one active ------------------------
+
+def select_objects(self, context, objs):
+    for obj in objs:
+        obj.select_set(True)
+
+    if objs:
+        context.view_layer.objects.active = objs[-1]
+
+
+# Get the coordinates of all vertices of a mesh object -------------------------
+
+def vertex_coords(self, obj, z_offset = 0):
+    n = len(obj.data.vertices)
+    coords = np.empty(n * 3, dtype = np.float32)
+    obj.data.vertices.foreach_get("co", coords)
+    coords = coords.reshape(n, 3)
+    coords[:, 2] += z_offset
+
+    return coords
+
+
 # Convert vertex color layer into a mesh material ------------------------------
 
 def vtx_color_to_material(self, obj, name):
@@ -71,12 +113,20 @@ def vtx_color_to_material(self, obj, name):
 # Apply colors to vertices of a mesh object ------------------------------------
 
 def color_vertices(self, obj, vtx_color, name):
-    with bmesh_from_obj(obj) as bm:
-        layer = bm.loops.layers.color.new(name)
-        name = layer.name
-        for f in bm.faces:
-            for loop in f.loops:
-                loop[layer] = vtx_color[loop.vert.index]
+    mesh = obj.data
+    layer = mesh.color_attributes.new(name, 'FLOAT_COLOR', 'CORNER')
+    name = layer.name
+
+    # Float color attributes are scene-linear, so decode the sRGB channels
+    vtx_color = np.array(vtx_color, dtype = np.float32)
+    rgb = vtx_color[:, :3]
+    vtx_color[:, :3] = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+
+    # Look up the vertex of every face corner & write all colors in one batch
+    loop_vtx = np.empty(len(mesh.loops), dtype = np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vtx)
+    loop_color = vtx_color[loop_vtx]
+    layer.data.foreach_set("color", loop_color.ravel())
 
     # Set the new vertex color layer as the active layer & link to a material
     obj.data.attributes.active_color = obj.data.color_attributes.get(name)
@@ -93,7 +143,6 @@ def normalize_mesh(self, obj, n_cuts, smooth_factor, smooth_x, smooth_y, smooth_
             cuts = n_cuts, 
             use_grid_fill = True
         )
-        bmesh.ops.triangulate(bm, faces = bm.faces)
         bmesh.ops.smooth_vert(
             bm, 
             verts = bm.verts, 
@@ -106,7 +155,7 @@ def normalize_mesh(self, obj, n_cuts, smooth_factor, smooth_x, smooth_y, smooth_
 
 # Create a bezier curve --------------------------------------------------------
 
-def create_bezier(self, context, collection, name, coords, radius):
+def create_bezier(self, context, collection, name, coords, radius, set_active = True):
 
     # Create a new, empty curve and within collection
     curve = bpy.data.curves.new(name, type = 'CURVE')
@@ -121,22 +170,46 @@ def create_bezier(self, context, collection, name, coords, radius):
     # Map coordinates to a spline at defined radius
     spline = curve.splines.new('BEZIER')
     spline.bezier_points.add(len(coords) - 1)
-    for i, p in enumerate(coords):
-        spline.bezier_points[i].co = p
-        spline.bezier_points[i].handle_left_type  = 'AUTO'
-        spline.bezier_points[i].handle_right_type = 'AUTO'
-        spline.bezier_points[i].radius = radius
+    spline.bezier_points.foreach_set("co", np.asarray(coords, dtype = np.float32).ravel())
+    spline.bezier_points.foreach_set("radius", np.full(len(coords), radius, dtype = np.float32))
+
+    # Handle types have no bulk setter; setting them also recalculates handles
+    for p in spline.bezier_points:
+        p.handle_left_type  = 'AUTO'
+        p.handle_right_type = 'AUTO'
 
     # Set as active & selected for any subsequent operations
-    context.view_layer.objects.active = obj
-    context.object.select_set(True)
+    if set_active:
+        select_objects(self, context, [obj])
 
     return obj
 
 
+# Project a curve object onto the surface of a target mesh --------------------
+
+SHRINKWRAP_SETTINGS = {
+    "wrap_method": 'PROJECT',
+    "wrap_mode": 'ABOVE_SURFACE',
+    "use_project_x": False,
+    "use_project_y": False,
+    "use_project_z": True,
+    "use_negative_direction": True,
+    "use_positive_direction": True,
+    "offset": 0.01,
+}
+
+def shrinkwrap_to_surface(self, obj, target):
+    modifier = obj.modifiers.new(name = "Shrinkwrap", type = 'SHRINKWRAP')
+    modifier.target = target
+    for attr, value in SHRINKWRAP_SETTINGS.items():
+        setattr(modifier, attr, value)
+
+    return modifier
+
+
 # Create a primitive sphere ----------------------------------------------------
 
-def create_sphere(self, context, collection, name, coords, radius):
+def create_sphere(self, context, collection, name, coords, radius, set_active = True):
 
     # Create a new, empty mesh and within collection
     mesh = bpy.data.meshes.new(name)
@@ -148,8 +221,8 @@ def create_sphere(self, context, collection, name, coords, radius):
         bmesh.ops.translate(bm, verts = bm.verts, vec = coords)
 
     # Set as active & selected for any subsequent operations
-    context.view_layer.objects.active = obj
-    context.object.select_set(True)
+    if set_active:
+        select_objects(self, context, [obj])
 
     return obj
 
@@ -158,43 +231,129 @@ def create_sphere(self, context, collection, name, coords, radius):
 # AZGAAR DATA & OBJECT OPERATIONS
 ################################################################################
 
+# Load a JSON export, streaming only the data used by the importer -------------
+
+# Exports at least this large are streamed, trading load time for memory
+STREAM_MIN_BYTES = 256 * 1024 * 1024
+
+# Values copied whole out of a streamed export
+STREAM_ITEMS = (
+    "info",
+    "grid.cellsX",
+    "grid.cellsY",
+    "biomesData.color",
+    "pack.rivers",
+    "pack.burgs",
+    "pack.routes",
+)
+
+# Per-cell values collected into flat typed columns instead of one dict per cell
+STREAM_COLUMNS = {
+    "grid.cells.item.h": ("grid.cells.h", "f", np.float32),
+    "pack.cells.item.g": ("pack.cells.g", "i", np.intc),
+    "pack.cells.item.biome": ("pack.cells.biome", "i", np.intc),
+}
+
+def set_nested(self, tree, path, value):
+    *parents, key = path.split(".")
+    for p in parents:
+        tree = tree.setdefault(p, {})
+    tree[key] = value
+
+
+def stream_json(self, f):
+    raw = {}
+    columns = {prefix: array(code) for prefix, (_, code, _) in STREAM_COLUMNS.items()}
+    builder = None
+
+    for prefix, event, value in ijson.parse(f, use_float = True):
+
+        # Build up a copied value until its closing event
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == item and event in ("end_map", "end_array"):
+                set_nested(self, raw, item, builder.value)
+                builder = None
+
+        elif prefix in columns:
+            columns[prefix].append(value)
+
+        elif prefix in STREAM_ITEMS:
+            if event in ("start_map", "start_array"):
+                item = prefix
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            else:
+                set_nested(self, raw, prefix, value)
+
+    for prefix, (path, _, dtype) in STREAM_COLUMNS.items():
+        set_nested(self, raw, path, np.frombuffer(columns[prefix], dtype = dtype))
+
+    return raw
+
+
+def load_json(self, filepath):
+    with open(filepath, "rb") as f:
+        if ijson and os.path.getsize(filepath) >= STREAM_MIN_BYTES:
+            return stream_json(self, f)
+        raw_bytes = f.read()
+
+    return orjson.loads(raw_bytes) if orjson else json.loads(raw_bytes)
+
+
+# Read columns of per-cell values, whether loaded per cell or streamed --------
+
+def cell_columns(self, cells, dtypes):
+    if isinstance(cells, dict):
+        return {key: np.asarray(cells[key], dtype = dtype) for key, dtype in dtypes.items()}
+
+    return {
+        key: np.fromiter(map(itemgetter(key), cells), dtype = dtype, count = len(cells))
+        for key, dtype in dtypes.items()
+    }
+
+
 # Extract cell data from raw JSON ----------------------------------------------
 
 def prepare_data(self, raw):
 
     w = raw["grid"]["cellsX"]
     h = raw["grid"]["cellsY"]
-    x = [ x - (w - 1) / 2 for y in range(h) for x in range(w)]
-    y = [-y + (h - 1) / 2 for y in range(h) for x in range(w)]
-    z = [c["h"] * self.z_scale for c in raw["grid"]["cells"]]
-
-    vtx = tuple(zip(x, y, z))
-    faces = [
-        (
-            w * (yi + 1) + xi,
-            w * (yi + 1) + xi + 1,
-            w * yi + xi + 1,
-            w * yi + xi,
-        )
-        for yi in range(h - 1)
-        for xi in range(w - 1)
-    ]
+
+    # Center the grid on the origin, with rows running from north to south;
+    # coordinates stay float32 to match Blender's own vertex storage
+    xs =   np.arange(w, dtype = np.float32) - np.float32((w - 1) / 2)
+    ys = -(np.arange(h, dtype = np.float32) - np.float32((h - 1) / 2))
+    x, y = (a.ravel() for a in np.meshgrid(xs, ys))
+    grid_cells = cell_columns(self, raw["grid"]["cells"], {"h": np.float32})
+    z = grid_cells["h"] * np.float32(self.z_scale)
+
+    vtx = np.stack([x, y, z], axis = 1)
+
+    # Split each grid square into two triangles from its top-left corner index
+    yi, xi = np.mgrid[0:h - 1, 0:w - 1]
+    base = w * yi + xi
+    faces = np.stack([
+        np.stack([base + w, base + w + 1, base + 1], axis = -1),
+        np.stack([base + w, base + 1,     base    ], axis = -1),
+    ], axis = -2)
+    faces = faces.reshape(-1, 3).astype(np.int32)
+
+    pack_cells = cell_columns(self, raw["pack"]["cells"], {"g": np.int32, "biome": np.int32})
+    cell_to_grid = pack_cells["g"].tolist()
 
     # Extract biomes from the pack object & default to zero where not given
-    biome_id = [0] * len(raw["grid"]["cells"])
-    for c in raw["pack"]["cells"]:
-        biome_id[c["g"]] = c["biome"]
-
-    # Convert biome colors from hex to RGBA notation
-    biome_rgb = [
-        [int((h.lstrip('#') + 'ff')[i:i+2], 16) / 255 for i in (0, 2, 4, 6)]
-        for h in raw["biomesData"]["color"]
-    ]
+    biome_id = np.zeros(w * h, dtype = np.int32)
+    biome_id[pack_cells["g"]] = pack_cells["biome"]
 
-    # Assign each vertex a color based on its biome
-    color = [biome_rgb[b] for b in biome_id]
+    # Convert biome colors from hex to RGBA notation, defaulting to opaque
+    biome_hex = [c.lstrip('#') for c in raw["biomesData"]["color"]]
+    biome_hex = [c + 'ff' if len(c) == 6 else c for c in biome_hex]
+    biome_rgb = np.frombuffer(bytes.fromhex("".join(biome_hex)), dtype = np.uint8)
+    biome_rgb = biome_rgb.reshape(-1, 4).astype(np.float32) / 255
 
-    cell_to_grid = [c["g"] for c in raw["pack"]["cells"]]
+    # Assign each vertex a color based on its biome, as a float32 (V, 4) array
+    color = biome_rgb[biome_id]
 
     # Extract river paths
     river_id_format = "River {:0" + str(len(str(len(raw["pack"]["rivers"])))) + "d}"
@@ -253,14 +412,19 @@ def create_heightmap(self, context):
 
     obj = create_mesh(self, context, self.collection, "Heightmap")
 
-    with bmesh_from_obj(obj) as bm:
-        for v in self.data["vtx"]:
-            bm.verts.new(v)
-
-        bm.verts.ensure_lookup_table()
-
-        for f in self.data["faces"]:
-            bm.faces.new((bm.verts[v] for v in f))
+    # Upload vertices & triangles straight from their NumPy buffers
+    mesh = obj.data
+    vtx = self.data["vtx"]
+    faces = self.data["faces"]
+    mesh.vertices.add(len(vtx))
+    mesh.vertices.foreach_set("co", vtx.ravel())
+    mesh.loops.add(faces.size)
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, 3, dtype = np.int32))
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", np.full(len(faces), 3, dtype = np.int32))
+    mesh.polygons.foreach_set("vertices", faces.ravel())
+    mesh.update(calc_edges = True)
 
     color_vertices(self, obj, self.data["color"], "Biomes")
     normalize_mesh(self, obj, 1, 1, True, True, True)
@@ -277,16 +441,15 @@ def create_ocean_plane(self, context):
 
     w = self.data["w"]
     h = self.data["h"]
+    z = self.sea_level * self.z_scale
 
     # Use canvas size to create 4 corners
-    with bmesh_from_obj(obj) as bm:
-        bm.verts.new((-w / 2, -h / 2, self.sea_level * self.z_scale))
-        bm.verts.new(( w / 2, -h / 2, self.sea_level * self.z_scale))
-        bm.verts.new(( w / 2,  h / 2, self.sea_level * self.z_scale))
-        bm.verts.new((-w / 2,  h / 2, self.sea_level * self.z_scale))
-        bm.faces.new(bm.verts)
+    corners = [(-w / 2, -h / 2, z), (w / 2, -h / 2, z), (w / 2, h / 2, z), (-w / 2, h / 2, z)]
+    obj.data.from_pydata(corners, [], [(0, 1, 2, 3)])
+    obj.data.update()
 
-    color_vertices(self, obj, [self.data["biome_rgb"][0]] * 4, "Ocean")
+    ocean_rgb = self.data["biome_rgb"][0]
+    color_vertices(self, obj, np.broadcast_to(ocean_rgb, (4, 4)), "Ocean")
 
     return obj
 
@@ -300,10 +463,9 @@ def create_rivers(self, context, heightmap):
     self.collection.children.link(coll)
 
     # Get the current X-Y coordinates of each cell on the smoothed heightmap
-    offset = 0.1
-    cell_coords = [(v.co.x, v.co.y, v.co.z + offset) for v in heightmap.data.vertices]
+    cell_coords = vertex_coords(self, heightmap, z_offset = 0.1)
     river_coords = [
-        [cell_coords[c] for c in clist] 
+        cell_coords[np.asarray(clist, dtype = np.intp)]
         for clist in self.data["river"]["cells"]
     ]
     river_radius = [w / 2 for w in self.data["river"]["width"]]
@@ -314,7 +476,7 @@ def create_rivers(self, context, heightmap):
 
     # Create bezier curve objects for each river
     objs = [
-        create_bezier(self, context, coll, name, coords, radius)
+        create_bezier(self, context, coll, name, coords, radius, set_active = False)
         for coords, radius, name in zip(
             river_coords, 
             river_radius, 
@@ -324,20 +486,14 @@ def create_rivers(self, context, heightmap):
 
     for obj in objs:
         # Flatten each river to the heightmap surface
-        modifier = obj.modifiers.new(name = "Shrinkwrap", type = 'SHRINKWRAP')
-        modifier.target = heightmap
-        modifier.wrap_method = 'PROJECT'
-        modifier.wrap_mode = 'ABOVE_SURFACE'
-        modifier.use_project_x = False
-        modifier.use_project_y = False
-        modifier.use_project_z = True
-        modifier.use_negative_direction = True
-        modifier.use_positive_direction = True
-        modifier.offset = 0.01
+        shrinkwrap_to_surface(self, obj, heightmap)
 
         # Apply blue water material
         obj.data.materials.append(mat)
 
+    # Select all rivers at once rather than as each one is created
+    select_objects(self, context, objs)
+
     return objs
 
 
@@ -350,14 +506,15 @@ def create_burgs(self, context, heightmap):
     self.collection.children.link(coll)
 
     # Get the current X-Y coordinates of each cell on the smoothed heightmap
-    cell_coords = [(v.co.x, v.co.y, v.co.z) for v in heightmap.data.vertices]
-    burg_coords = [cell_coords[c] for c in self.data["burg"]["cell"]]
+    cell_coords = vertex_coords(self, heightmap)
+    burg_coords = cell_coords[np.asarray(self.data["burg"]["cell"], dtype = np.intp)]
 
     # Create an icosphere for each burg
     objs = [
-        create_sphere(self, context, coll, name, coords, 0.3)
+        create_sphere(self, context, coll, name, coords, 0.3, set_active = False)
         for coords, name in zip(burg_coords, self.data["burg"]["obj_id"])
     ]
+    select_objects(self, context, objs)
 
     return objs
 
@@ -371,31 +528,23 @@ def create_routes(self, context, heightmap):
     self.collection.children.link(coll)
 
     # Get the current X-Y coordinates of each cell on the smoothed heightmap
-    offset = 0.1
-    cell_coords = [(v.co.x, v.co.y, v.co.z + offset) for v in heightmap.data.vertices]
+    cell_coords = vertex_coords(self, heightmap, z_offset = 0.1)
     route_coords = [
-        [cell_coords[c] for c in clist] 
+        cell_coords[np.asarray(clist, dtype = np.intp)]
         for clist in self.data["route"]["cells"]
     ]
 
     # Create bezier curve objects for each route
     objs = [
-        create_bezier(self, context, coll, name, coords, 1)
+        create_bezier(self, context, coll, name, coords, 1, set_active = False)
         for coords, name in zip(route_coords, self.data["route"]["obj_id"])
     ]
 
     for obj in objs:
         # Flatten each route to the heightmap surface
-        modifier = obj.modifiers.new(name = "Shrinkwrap", type = 'SHRINKWRAP')
-        modifier.target = heightmap
-        modifier.wrap_method = 'PROJECT'
-        modifier.wrap_mode = 'ABOVE_SURFACE'
-        modifier.use_project_x = False
-        modifier.use_project_y = False
-        modifier.use_project_z = True
-        modifier.use_negative_direction = True
-        modifier.use_positive_direction = True
-        modifier.offset = 0.01
+        shrinkwrap_to_surface(self, obj, heightmap)
+
+    select_objects(self, context, objs)
 
     # TEMPORARY: exclude by default due to issues with discontinuous routes
     map_coll = bpy.context.view_layer.layer_collection.children[self.collection.name]
@@ -409,8 +558,7 @@ def create_routes(self, context, heightmap):
 def import_azgaar(self, context):
     if self.filepath:
         try:
-            with open(self.filepath, "r") as f:
-                raw_data = json.load(f)
+            raw_data = load_json(self, self.filepath)
 
             # Generate a new collection to store all Azgaar objects
             map_name = raw_data["info"]["mapName"]